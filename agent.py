@@ -1,12 +1,23 @@
 import logging
 from dotenv import load_dotenv
+
+load_dotenv()  # Load environment variables before tools.py reads them at import
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 from livekit import agents
 from livekit.agents import AgentSession, Agent, RoomInputOptions
 from livekit.plugins import noise_cancellation, google
 from prompts import AGENT_INSTRUCTION, SESSION_INSTRUCTION
-from tools import get_weather, search_web, send_email, generate_ai_image, generate_code, write_essay
+from tools import get_weather, search_web, send_email, generate_ai_image, generate_code, write_essay, close_http_session
 
-load_dotenv()  # Load environment variables early
+# Built once per worker process and shared by every session it runs.
+# BVC() is only a config handle for the native filter, so reusing it across sessions is safe.
+_TOOLS = (get_weather, search_web, send_email, generate_ai_image,
+          generate_code, write_essay)
+_BVC = noise_cancellation.BVC()  # LiveKit BVC for voice clarity
+_ROOM_OPTS = RoomInputOptions(video_enabled=True, noise_cancellation=_BVC)
 
 
 # ================================
@@ -21,10 +32,7 @@ class Assistant(Agent):
                 voice="Aoede",  # Voice options: Aoede, Melody, etc.
                 temperature=0.8,
             ),
-            tools=[
-                get_weather, search_web, send_email, generate_ai_image,
-                generate_code, write_essay
-            ],
+            tools=list(_TOOLS),  # Agent expects a list it can copy
         )
 
 
@@ -35,16 +43,15 @@ async def entrypoint(ctx: agents.JobContext):
     # Connect to LiveKit room first
     await ctx.connect()
 
+    # Release the shared HTTP session used by the tools when the job ends
+    ctx.add_shutdown_callback(close_http_session)
+
     session = AgentSession()
 
     await session.start(
         room=ctx.room,
         agent=Assistant(),
-        room_input_options=RoomInputOptions(
-            video_enabled=True,
-            noise_cancellation=noise_cancellation.BVC(
-            ),  # LiveKit BVC for voice clarity
-        ),
+        room_input_options=_ROOM_OPTS,
     )
 
     await session.generate_reply(instructions=SESSION_INSTRUCTION, )
@@ -1,38 +1,287 @@
+import asyncio
 import logging
 import os
-import json
-import smtplib
-import requests
+import aiohttp
+import orjson
 import base64
+import hashlib
 import pathlib
+import random
+import time
+import urllib.parse
+from collections import OrderedDict, deque
 from datetime import datetime
-from PIL import Image
 import io
-from together import Together
-from typing import Optional
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from typing import TYPE_CHECKING, Optional
+from cachetools import TTLCache
 from livekit.agents import function_tool, RunContext
 
-logging.basicConfig(level=logging.INFO)
+# PIL, together and smtplib/email are imported lazily by the tools that need them,
+# so sessions that never send email or generate images don't pay for them at startup.
+if TYPE_CHECKING:
+    import smtplib
+
+logger = logging.getLogger(__name__)
+
+# ================================
+# SHARED HTTP SESSION
+# ================================
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+
+if not OPENROUTER_API_KEY:
+    logger.warning(
+        "OPENROUTER_API_KEY is not set; search, code and essay tools are disabled")
+
+_OPENROUTER_HEADERS = {
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "HTTP-Referer": "https://your-site.com",  # Optional
+    "X-Title": "MiaAssistant",  # Optional
+}
+
+# Bounded timeouts so a hung upstream can never stall the agent indefinitely.
+# Streams have no total cap but must keep producing data.
+_HTTP_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=3)
+_OPENROUTER_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=3, sock_read=15)
+
+_RETRY_STATUSES = {429, 502, 503, 504}
+_RETRY_ATTEMPTS = 3
+_RETRY_BACKOFF = 0.3  # seconds, doubled per attempt
+
+_http_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Returns the shared aiohttp session, creating it on first use inside the running event loop.
+    Connections to OpenRouter and wttr.in are kept alive so TLS handshakes are reused across calls.
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(limit=16,
+                                         limit_per_host=16,
+                                         keepalive_timeout=60)
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            headers={"Content-Type": "application/json"},
+            timeout=_HTTP_TIMEOUT,
+        )
+    return _http_session
+
+
+async def close_http_session() -> None:
+    """
+    Closes the shared aiohttp session. Registered as a shutdown hook in agent.py.
+    """
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    Only connection-phase failures and throttling/gateway statuses are retried. A request that hit
+    its total or read timeout, or lost its body mid-stream, would most likely do so again.
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in _RETRY_STATUSES
+    if isinstance(error, aiohttp.ServerTimeoutError):
+        # Also the base class of read timeouts, so single out connect timeouts
+        return isinstance(error, aiohttp.ConnectionTimeoutError)
+    return isinstance(error, aiohttp.ClientConnectionError)
+
+
+async def _with_retries(request, *args, **kwargs):
+    """
+    Awaits request(*args, **kwargs), retrying connection errors, connect timeouts, 429s and 502-504s
+    with jittered exponential backoff.
+    """
+    for attempt in range(1, _RETRY_ATTEMPTS + 1):
+        try:
+            return await request(*args, **kwargs)
+        except Exception as e:
+            if attempt == _RETRY_ATTEMPTS or not _is_retryable(e):
+                raise
+            delay = _RETRY_BACKOFF * 2**(attempt - 1)
+            delay += random.uniform(0, delay)
+            # str() only, never repr(): a ClientResponseError's repr includes the request
+            # headers, which carry the OpenRouter API key
+            logger.warning("Retrying %s in %.2fs after %s: %s",
+                           request.__name__, delay, type(e).__name__, e)
+            await asyncio.sleep(delay)
+
+
+# ================================
+# OPENROUTER REQUESTS (batched + streamed)
+# ================================
+_OPENROUTER_BATCH_WINDOW = 0.03  # seconds
+_openrouter_queue: deque = deque()
+_openrouter_worker: Optional[asyncio.Task] = None
+# Strong references to in-flight requests so they aren't garbage collected mid-stream
+_openrouter_tasks: set = set()
+# Caps in-flight completions on the shared API key so a burst of tool calls doesn't trigger 429s
+_openrouter_sem = asyncio.Semaphore(4)
+
+
+async def _stream_openrouter(payload: dict,
+                             timeout: Optional[aiohttp.ClientTimeout]):
+    """
+    Streams a chat completion from OpenRouter, yielding content deltas as the SSE frames arrive.
+    """
+    session = get_http_session()
+    async with session.post(
+            OPENROUTER_URL,
+            headers=_OPENROUTER_HEADERS,
+            data=orjson.dumps({
+                **payload, "stream": True
+            }),
+            timeout=timeout or _OPENROUTER_TIMEOUT,
+    ) as response:
+        response.raise_for_status()
+        async for raw_line in response.content:
+            line = raw_line.strip()
+            # Blank lines separate frames and ":" lines are keep-alive comments
+            if not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:"):].strip()
+            if data == b"[DONE]":
+                break
+            chunk = orjson.loads(data)
+            if "error" in chunk:
+                raise RuntimeError(chunk["error"].get("message", chunk["error"]))
+            choices = chunk.get("choices") or [{}]
+            content = choices[0].get("delta", {}).get("content")
+            if content:
+                yield content
+
+
+async def _post_openrouter(payload: dict,
+                           timeout: Optional[aiohttp.ClientTimeout]) -> str:
+    async with _openrouter_sem:
+        parts = [
+            content
+            async for content in _stream_openrouter(payload, timeout)
+        ]
+    text = "".join(parts).strip()
+    # Full completions can be tens of KB, so only build the log line when DEBUG is on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("OpenRouter %s reply (%d chars): %s", payload["model"],
+                     len(text), text)
+    return text
+
+
+def _link_request(future: asyncio.Future, task: asyncio.Task) -> None:
+    """
+    Ties a caller's future to the task sending its request: cancelling the caller cancels the
+    HTTP request, and the task's outcome is handed back to the caller.
+    """
+
+    def on_future_done(fut: asyncio.Future) -> None:
+        if fut.cancelled():
+            task.cancel()
+
+    def on_task_done(t: asyncio.Task) -> None:
+        _openrouter_tasks.discard(t)
+        if future.done():
+            return
+        if t.cancelled():
+            future.cancel()
+        elif t.exception() is not None:
+            future.set_exception(t.exception())
+        else:
+            future.set_result(t.result())
+
+    future.add_done_callback(on_future_done)
+    task.add_done_callback(on_task_done)
+
+
+async def _drain_openrouter_queue() -> None:
+    """
+    Waits one batch window, then starts every queued OpenRouter request at once.
+    """
+    global _openrouter_worker
+    await asyncio.sleep(_OPENROUTER_BATCH_WINDOW)
+    batch = list(_openrouter_queue)
+    _openrouter_queue.clear()
+    # Requests queued from here on start a new batch
+    _openrouter_worker = None
+
+    for future, payload, timeout in batch:
+        # Callers cancelled while still queued never reach OpenRouter
+        if future.done():
+            continue
+        task = asyncio.create_task(
+            _with_retries(_post_openrouter, payload, timeout))
+        _openrouter_tasks.add(task)
+        _link_request(future, task)
+
+
+async def _openrouter_call(model: str,
+                           messages: list,
+                           timeout: Optional[aiohttp.ClientTimeout] = None) -> str:
+    """
+    Queues a chat completion request and returns the reply text once its batch has been sent.
+    Cancelling the caller also cancels the underlying HTTP request.
+    """
+    global _openrouter_worker
+    future = asyncio.get_running_loop().create_future()
+    payload = {"model": model, "messages": messages}
+    _openrouter_queue.append((future, payload, timeout))
+    if _openrouter_worker is None:
+        _openrouter_worker = asyncio.create_task(_drain_openrouter_queue())
+
+    return await future
 
 
 # ================================
 # WEATHER TOOL
 # ================================
+MAX_CITY_CHARS = 64
+MAX_PROMPT_CHARS = 8000
+
+_WEATHER_CACHE_TTL = 900  # seconds
+_WEATHER_CACHE_MAX_SIZE = 256
+_weather_cache: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+
+
+async def _fetch_weather(city: str) -> tuple[int, str]:
+    session = get_http_session()
+    async with session.get(
+            f"https://wttr.in/{urllib.parse.quote(city, safe='')}?format=3",
+            timeout=aiohttp.ClientTimeout(total=10, connect=3)) as response:
+        if response.status in _RETRY_STATUSES:
+            response.raise_for_status()
+        return response.status, (await response.text()).strip()
+
+
 @function_tool()
 async def get_weather(context: RunContext, city: str) -> str:
+    if not city or not city.strip() or len(city) > MAX_CITY_CHARS:
+        return "Invalid city."
+
+    city = city.strip()
+    key = city.lower()
+    cached = _weather_cache.get(key)
+    if cached and time.monotonic() - cached[0] < _WEATHER_CACHE_TTL:
+        _weather_cache.move_to_end(key)
+        return cached[1]
+
     try:
-        response = requests.get(f"https://wttr.in/{city}?format=3")
-        if response.status_code == 200:
-            logging.info(f"Weather for {city}: {response.text.strip()}")
-            return response.text.strip()
+        status, text = await _with_retries(_fetch_weather, city)
+        if status == 200:
+            logger.info("Weather for %s: %s", city, text)
+            # Only successful responses are cached so transient errors are retried
+            _weather_cache[key] = (time.monotonic(), text)
+            _weather_cache.move_to_end(key)
+            if len(_weather_cache) > _WEATHER_CACHE_MAX_SIZE:
+                _weather_cache.popitem(last=False)
+            return text
         else:
-            logging.error(
-                f"Failed to get weather for {city}: {response.status_code}")
+            logger.error("Failed to get weather for %s: %s", city, status)
             return f"Could not retrieve weather for {city}."
     except Exception as e:
-        logging.error(f"Error retrieving weather for {city}: {e}")
+        logger.error("Error retrieving weather for %s: %s", city, e)
         return f"An error occurred while retrieving weather for {city}."
 
 
@@ -41,41 +290,133 @@ async def get_weather(context: RunContext, city: str) -> str:
 # ================================
 @function_tool()
 async def search_web(context: RunContext, query: str) -> str:
+    if not query or not query.strip():
+        return "Please provide something to search for."
+    if len(query) > MAX_PROMPT_CHARS:
+        return f"Search query is too long (max {MAX_PROMPT_CHARS} characters)."
+
     try:
-        api_key = os.getenv("OPENROUTER_API_KEY")
-        if not api_key:
+        if not OPENROUTER_API_KEY:
             return "OpenRouter API key not found. Please check your .env file."
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
-
-        payload = {
-            "model": "tngtech/deepseek-r1t-chimera:free",
-            "messages": [{
+        return await _openrouter_call(
+            "tngtech/deepseek-r1t-chimera:free",
+            [{
                 "role": "user",
                 "content": query
             }],
-        }
-
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(payload),
         )
-        response.raise_for_status()
-        data = response.json()
-        return data["choices"][0]["message"]["content"].strip()
 
     except Exception as e:
-        logging.error(f"Error talking to OpenRouter AI: {e}")
+        logger.error("Error talking to OpenRouter AI: %s", e)
         return f"Error talking to OpenRouter AI: {e}"
 
 
 # ================================
 # EMAIL TOOL
 # ================================
+class _PooledSmtp:
+    """
+    An authenticated SMTP connection plus the bookkeeping used to decide when to recycle it.
+    """
+
+    def __init__(self, server: "smtplib.SMTP") -> None:
+        self.server = server
+        self.created_at = time.monotonic()
+        self.messages_sent = 0
+
+
+class _SmtpPool:
+    """
+    Small pool of logged-in SMTP connections so each email skips the connect/STARTTLS/login phase.
+    smtplib is blocking, so connecting and closing run in a worker thread.
+    """
+
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 max_size: int = 5,
+                 max_age: float = 100,
+                 max_messages: int = 100) -> None:
+        self.host = host
+        self.port = port
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self._idle: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+
+    def _connect(self, user: str, password: str) -> "smtplib.SMTP":
+        import smtplib
+
+        server = smtplib.SMTP(self.host, self.port)
+        try:
+            server.starttls()
+            server.login(user, password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    @staticmethod
+    def _close(server: "smtplib.SMTP") -> None:
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @staticmethod
+    def _is_alive(server: "smtplib.SMTP") -> bool:
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _expired(self, conn: _PooledSmtp) -> bool:
+        return (time.monotonic() - conn.created_at > self.max_age
+                or conn.messages_sent >= self.max_messages)
+
+    async def acquire(self, user: str, password: str) -> _PooledSmtp:
+        while not self._idle.empty():
+            conn = self._idle.get_nowait()
+            # The server may have dropped an idle session, so probe it before handing it out
+            if not self._expired(conn) and await asyncio.to_thread(
+                    self._is_alive, conn.server):
+                return conn
+            await asyncio.to_thread(self._close, conn.server)
+        server = await asyncio.to_thread(self._connect, user, password)
+        return _PooledSmtp(server)
+
+    async def release(self, conn: _PooledSmtp, discard: bool = False) -> None:
+        if discard or self._expired(conn) or self._idle.full():
+            await asyncio.to_thread(self._close, conn.server)
+            return
+        self._idle.put_nowait(conn)
+
+
+_smtp_pool = _SmtpPool("smtp.gmail.com", 587)
+
+GMAIL_USER = os.getenv("GMAIL_USER")
+GMAIL_APP_PASSWORD = os.getenv("GMAIL_APP_PASSWORD")
+
+
+def _send_sync(server: "smtplib.SMTP", to_email: str, subject: str,
+               message: str, cc_email: Optional[str]) -> None:
+    """
+    Builds and sends the message on an already logged-in connection. Runs in a worker thread.
+    """
+    from email.message import EmailMessage
+
+    msg = EmailMessage()
+    msg["From"] = GMAIL_USER
+    msg["To"] = to_email
+    if cc_email:
+        msg["Cc"] = cc_email
+    msg["Subject"] = subject
+    msg.set_content(message)
+
+    # send_message takes the recipients from the To/Cc headers
+    server.send_message(msg)
+
+
 @function_tool()
 async def send_email(
     context: RunContext,
@@ -84,52 +425,98 @@ async def send_email(
     message: str,
     cc_email: Optional[str] = None,
 ) -> str:
-    try:
-        smtp_server = "smtp.gmail.com"
-        smtp_port = 587
-        gmail_user = os.getenv("GMAIL_USER")
-        gmail_password = os.getenv("GMAIL_APP_PASSWORD")
+    import smtplib
 
-        if not gmail_user or not gmail_password:
-            logging.error(
+    try:
+        if not GMAIL_USER or not GMAIL_APP_PASSWORD:
+            logger.error(
                 "Gmail credentials not found in environment variables")
             return "Email sending failed: Gmail credentials not configured."
 
-        msg = MIMEMultipart()
-        msg["From"] = gmail_user
-        msg["To"] = to_email
-        msg["Subject"] = subject
-
-        recipients = [to_email]
-        if cc_email:
-            msg["Cc"] = cc_email
-            recipients.append(cc_email)
-
-        msg.attach(MIMEText(message, "plain"))
-
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(gmail_user, gmail_password)
-        server.sendmail(gmail_user, recipients, msg.as_string())
-        server.quit()
-
-        logging.info(f"Email sent successfully to {to_email}")
+        # smtplib only does blocking socket I/O, so every SMTP step runs via asyncio.to_thread
+        conn = await _smtp_pool.acquire(GMAIL_USER, GMAIL_APP_PASSWORD)
+        discard = False
+        try:
+            await asyncio.to_thread(_send_sync, conn.server, to_email,
+                                    subject, message, cc_email)
+            conn.messages_sent += 1
+        except Exception:
+            # A connection that failed mid-send is not trusted for reuse
+            discard = True
+            raise
+        finally:
+            await _smtp_pool.release(conn, discard=discard)
+
+        logger.info("Email sent successfully to %s", to_email)
         return f"Email sent successfully to {to_email}"
 
     except smtplib.SMTPAuthenticationError:
-        logging.error("Gmail authentication failed")
+        logger.error("Gmail authentication failed")
         return "Email sending failed: Authentication error. Please check your Gmail credentials."
     except smtplib.SMTPException as e:
-        logging.error(f"SMTP error occurred: {e}")
+        logger.error("SMTP error occurred: %s", e)
         return f"Email sending failed: SMTP error - {str(e)}"
     except Exception as e:
-        logging.error(f"Error sending email: {e}")
+        logger.error("Error sending email: %s", e)
         return f"An error occurred while sending email: {str(e)}"
 
 
 # ================================
 # AI IMAGE GENERATOR (Together AI)
 # ================================
+_PICTURES_DIR = pathlib.Path.home() / "Pictures"
+_PICTURES_DIR.mkdir(parents=True, exist_ok=True)
+
+PREVIEW_SIZE = (512, 512)
+PREVIEW_QUALITY = 80
+
+# Built once; "saved" and "download" are empty when they don't apply.
+# A data URL only ever fills "src", so its base64 lands in the reply exactly once.
+_IMG_RESPONSE_TEMPLATE = (
+    "✅ {heading}<br>"
+    "{saved}"
+    "🖼️ {preview_label}:<br>"
+    '<img src="{src}" alt="{prompt}" style="max-width:100%; border-radius:12px;"/><br>'
+    "{download}")
+_DOWNLOAD_LINK_TEMPLATE = (
+    '<a href="{href}" download="ai_image.png" style="display:inline-block;margin-top:10px;padding:8px 12px;background-color:#007bff;color:white;border-radius:6px;text-decoration:none;">⬇ Download Image</a>'
+)
+
+TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
+_together_client = None
+# The free FLUX tier rate-limits hard, so only two generations run at once
+_together_sem = asyncio.Semaphore(2)
+_pil_image = None
+
+
+def _get_together_client():
+    """
+    Imports the Together SDK and builds its client on first use, then reuses it.
+    """
+    global _together_client
+    if _together_client is None:
+        from together import Together
+        _together_client = Together(api_key=TOGETHER_API_KEY)
+    return _together_client
+
+
+def _make_preview(image_bytes: bytes) -> str:
+    """
+    Shrinks the full-res PNG into a small WebP and returns it base64-encoded for the inline preview.
+    """
+    global _pil_image
+    if _pil_image is None:
+        from PIL import Image
+        _pil_image = Image
+    Image = _pil_image
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.thumbnail(PREVIEW_SIZE, Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", quality=PREVIEW_QUALITY)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
 @function_tool()
 async def generate_ai_image(context: RunContext, prompt: str) -> str:
     try:
@@ -137,67 +524,130 @@ async def generate_ai_image(context: RunContext, prompt: str) -> str:
                 prompt.strip()) < 3:
             return "❌ Please provide a clear description of the image you want."
 
-        api_key = os.getenv("TOGETHER_API_KEY")
-        if not api_key:
+        if not TOGETHER_API_KEY:
             return "❌ Together AI API key not found. Please check your .env file."
 
-        client = Together(api_key=api_key)
-
-        response = client.images.generate(
-            prompt=prompt.strip(),
-            model="black-forest-labs/FLUX.1-schnell-Free",
-            steps=4,
-            n=1,
-            height=1024,
-            width=1024,
-        )
+        # The first call imports the SDK; that and the blocking request both run in a worker thread
+        client = await asyncio.to_thread(_get_together_client)
+        async with _together_sem:
+            response = await asyncio.to_thread(
+                client.images.generate,
+                prompt=prompt.strip(),
+                model="black-forest-labs/FLUX.1-schnell-Free",
+                steps=4,
+                n=1,
+                height=1024,
+                width=1024,
+            )
 
         if not response or not hasattr(response, "data") or not response.data:
-            logging.error(f"No image data returned: {response}")
+            logger.error("No image data returned: %s", response)
             return "❌ No image data was returned. Try a different prompt."
 
         image_info = response.data[0]
-        image_base64 = getattr(image_info, "b64_json", None)
-        image_url = getattr(image_info, "url", None)
+        image_base64 = image_info.b64_json if hasattr(image_info,
+                                                      "b64_json") else None
+        image_url = image_info.url if hasattr(image_info, "url") else None
 
         if not image_base64 and not image_url:
-            logging.error(f"No usable image returned: {vars(image_info)}")
+            # Log field names only; the values can hold large base64 payloads
+            logger.error("No usable image returned: keys=%s",
+                         list(vars(image_info).keys()))
             return "❌ Image generation failed: no usable output."
 
         if image_base64:
-            image_bytes = base64.b64decode(image_base64)
-            pictures_folder = os.path.join(pathlib.Path.home(), "Pictures")
-            os.makedirs(pictures_folder, exist_ok=True)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            image_path = os.path.join(pictures_folder,
-                                      f"ai_image_{timestamp}.png")
-
-            with open(image_path, "wb") as f:
-                f.write(image_bytes)
-
-            data_url = f"data:image/png;base64,{image_base64}"
-
-            return (
-                f"✅ Image generated successfully!<br>"
-                f"📁 Saved to: `{image_path}`<br>"
-                f"🖼️ Preview:<br>"
-                f'<img src="{data_url}" alt="{prompt}" style="max-width:100%; border-radius:12px;"/><br>'
-                f'<a href="{data_url}" download="ai_image.png" style="display:inline-block;margin-top:10px;padding:8px 12px;background-color:#007bff;color:white;border-radius:6px;text-decoration:none;">⬇ Download Image</a>'
-            )
+            # Decoding and saving a ~1MB PNG would stall voice I/O, so both run off the event loop
+            image_bytes = await asyncio.to_thread(base64.b64decode,
+                                                  image_base64)
+            # Microseconds keep concurrent generations from overwriting each other
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            image_path = _PICTURES_DIR / f"ai_image_{timestamp}.png"
+
+            write_task = asyncio.create_task(
+                asyncio.to_thread(image_path.write_bytes, image_bytes))
+
+            try:
+                # Only a downscaled preview is inlined; the full-res PNG stays on disk
+                try:
+                    preview_base64 = await asyncio.to_thread(
+                        _make_preview, image_bytes)
+                    data_url = f"data:image/webp;base64,{preview_base64}"
+                    preview_label = f"Preview ({PREVIEW_SIZE[0]}px)"
+                except Exception as e:
+                    # The image itself is fine, so inline the original rather than failing
+                    logger.warning(
+                        "Preview downscale failed, inlining full image: %s", e)
+                    data_url = f"data:image/png;base64,{image_base64}"
+                    preview_label = "Preview"
+
+                return _IMG_RESPONSE_TEMPLATE.format_map({
+                    "heading": "Image generated successfully!",
+                    "saved": f"📁 Full-resolution PNG saved to: `{image_path}`<br>",
+                    "preview_label": preview_label,
+                    "src": data_url,
+                    "download": "",
+                    "prompt": prompt,
+                })
+            finally:
+                await write_task
 
         elif image_url:
-            return (
-                f"✅ Image generated successfully via URL!<br>"
-                f"🖼️ Preview:<br>"
-                f'<img src="{image_url}" alt="{prompt}" style="max-width:100%; border-radius:12px;"/><br>'
-                f'<a href="{image_url}" download="ai_image.png" style="display:inline-block;margin-top:10px;padding:8px 12px;background-color:#007bff;color:white;border-radius:6px;text-decoration:none;">⬇ Download Image</a>'
-            )
+            return _IMG_RESPONSE_TEMPLATE.format_map({
+                "heading": "Image generated successfully via URL!",
+                "saved": "",
+                "preview_label": "Preview",
+                "src": image_url,
+                "download": _DOWNLOAD_LINK_TEMPLATE.format(href=image_url),
+                "prompt": prompt,
+            })
 
     except Exception as e:
-        logging.error(f"Image generation error: {e}")
+        logger.error("Image generation error: %s", e)
         return f"⚠️ Image generation failed: {str(e)}"
 
 
+# ================================
+# GENERATION CACHE (OpenRouter)
+# ================================
+_generation_cache: TTLCache = TTLCache(maxsize=512, ttl=3600)
+_generation_cache_lock = asyncio.Lock()
+
+
+async def _cached_generation(model: str,
+                             system_prompt: str,
+                             user_prompt: str,
+                             words: Optional[int] = None,
+                             timeout: Optional[aiohttp.ClientTimeout] = None) -> str:
+    """
+    Runs a system + user completion, reusing the reply for identical prompts for up to an hour.
+    """
+    key = hashlib.blake2b(
+        f"{model}|{system_prompt}|{user_prompt}|{words}".encode(),
+        digest_size=16).hexdigest()
+    async with _generation_cache_lock:
+        cached = _generation_cache.get(key)
+    if cached:
+        return cached
+
+    messages = [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": user_prompt
+        },
+    ]
+    content = await _openrouter_call(model, messages, timeout=timeout)
+
+    # Failures raise before this point and empty replies are not worth keeping
+    if content:
+        async with _generation_cache_lock:
+            _generation_cache[key] = content
+    return content
+
+
 # ================================
 # CODE GENERATION (OpenRouter)
 # ================================
@@ -206,44 +656,25 @@ async def generate_code(context: RunContext, prompt: str) -> str:
     """
     Generates code based on user prompt using OpenRouter with DeepSeek model.
     """
+    if not prompt or not prompt.strip():
+        return "❌ Please describe the code you want generated."
+    if len(prompt) > MAX_PROMPT_CHARS:
+        return f"❌ Code prompt is too long (max {MAX_PROMPT_CHARS} characters)."
+
     try:
-        api_key = os.getenv("OPENROUTER_API_KEY")
-        if not api_key:
+        if not OPENROUTER_API_KEY:
             return "❌ Missing OpenRouter API key. Please check your .env file."
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://your-site.com",  # Optional
-            "X-Title": "MiaAssistant",  # Optional
-        }
+        system_prompt = "You are a professional senior software engineer. Write complete, well-documented code for the task."
 
-        payload = {
-            "model":
+        return await _cached_generation(
             "deepseek/deepseek-r1-0528:free",
-            "messages": [{
-                "role":
-                "system",
-                "content":
-                "You are a professional senior software engineer. Write complete, well-documented code for the task."
-            }, {
-                "role": "user",
-                "content": prompt
-            }],
-        }
-
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=30)
-        response.raise_for_status()
-        result = response.json()
-
-        return result["choices"][0]["message"]["content"].strip()
+            system_prompt,
+            prompt,
+            timeout=aiohttp.ClientTimeout(total=30, connect=3))
 
     except Exception as e:
-        logging.error(f"Code generation failed: {e}")
+        logger.error("Code generation failed: %s", e)
         return f"❌ Code generation failed: {e}"
 
 
@@ -254,18 +685,16 @@ async def generate_code(context: RunContext, prompt: str) -> str:
 async def write_essay(context: RunContext,
                       topic: str,
                       words: int = 500) -> str:
+    if not topic or not topic.strip():
+        return "❌ Please provide a topic for the essay."
+    if len(topic) > MAX_PROMPT_CHARS:
+        return f"❌ Essay topic is too long (max {MAX_PROMPT_CHARS} characters)."
+    words = max(50, min(words, 5000))
+
     try:
-        api_key = os.getenv("OPENROUTER_API_KEY")
-        if not api_key:
+        if not OPENROUTER_API_KEY:
             return "❌ OpenRouter API key is missing. Please check your .env file."
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://your-site.com",
-            "X-Title": "MiaAssistant",
-        }
-
         system_prompt = (
             f"You are a professional academic writer. Write an original, human-sounding essay "
             f"on the topic provided. Avoid robotic phrasing, vary sentence structures, "
@@ -274,30 +703,11 @@ async def write_essay(context: RunContext,
 
         user_prompt = f"Write an essay on: {topic}"
 
-        payload = {
-            "model":
-            "mistralai/mixtral-8x7b-instruct",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": user_prompt
-                },
-            ],
-        }
-
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(payload),
-        )
-        response.raise_for_status()
-        result = response.json()
-        return result["choices"][0]["message"]["content"].strip()
+        return await _cached_generation("mistralai/mixtral-8x7b-instruct",
+                                        system_prompt,
+                                        user_prompt,
+                                        words=words)
 
     except Exception as e:
-        logging.error(f"Essay generation failed: {e}")
+        logger.error("Essay generation failed: %s", e)
         return f"❌ Essay generation failed: {e}"